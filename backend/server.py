@@ -1,8 +1,12 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Depends, UploadFile, File, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from redis.asyncio import Redis
 import os
 import logging
 from pathlib import Path
@@ -10,15 +14,20 @@ from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
 import httpx
 import random
 import string
 import aiofiles
+import aiofiles.os
 import asyncio
+import bisect
+import re
+from collections import OrderedDict, deque
 import secrets
 import hashlib
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+import hmac
+import orjson
 
 PAY_FIRST_MODE = os.getenv("PAY_FIRST_MODE","1")=="1"
 
@@ -26,12 +35,16 @@ PAY_FIRST_MODE = os.getenv("PAY_FIRST_MODE","1")=="1"
 def hash_otp(email: str, otp: str) -> str:
     return hashlib.sha256(f"{email}:{otp}".encode()).hexdigest()
 
+def otp_key(email: str) -> str:
+    return f"otp:{email}"
+
+def otp_attempts_key(email: str) -> str:
+    return f"otp_attempts:{email}"
+
+SENDGRID_SEND_URL = "https://api.sendgrid.com/v3/mail/send"
+
 async def send_otp_email(to_email: str, otp: str):
-    message = Mail(
-        from_email=os.environ["FROM_EMAIL"],
-        to_emails=to_email,
-        subject="Your EditCue login code",
-        html_content=f"""
+    html_content = f"""
         <div style="font-family:Arial">
           <h2>Your EditCue OTP</h2>
           <p>Use this code to log in:</p>
@@ -39,9 +52,25 @@ async def send_otp_email(to_email: str, otp: str):
           <p>This code expires in 10 minutes.</p>
         </div>
         """
+    # SendGrid v3 API over the shared keep-alive client
+    r = await http_client.post(
+        SENDGRID_SEND_URL,
+        headers={"Authorization": f"Bearer {os.environ['SENDGRID_API_KEY']}"},
+        json={
+            "personalizations": [{"to": [{"email": to_email}]}],
+            "from": {"email": os.environ["FROM_EMAIL"]},
+            "subject": "Your EditCue login code",
+            "content": [{"type": "text/html", "value": html_content}],
+        },
     )
-    sg = SendGridAPIClient(os.environ["SENDGRID_API_KEY"])
-    sg.send(message)
+    r.raise_for_status()
+
+async def send_otp_email_task(to_email: str, otp: str):
+    """Background-task wrapper: the request has already returned, so log failures"""
+    try:
+        await send_otp_email(to_email, otp)
+    except Exception as e:
+        logger.error(f"OTP email to {to_email} failed: {e}")
 
 ANTIDEO_API_KEY = os.getenv("ANTIDEO_API_KEY", "")
 ENABLE_ANTIDEO_EMAIL_CHECK = os.getenv("ENABLE_ANTIDEO_EMAIL_CHECK", "1") == "1"
@@ -64,22 +93,62 @@ async def antideo_email_health(email: str) -> dict:
         "X-API-KEY": ANTIDEO_API_KEY,
     }
 
-    async with httpx.AsyncClient(timeout=6.0) as client:
-        r = await client.get(url, headers=headers)
-        # Antideo uses standard error codes like 401 if key is wrong. :contentReference[oaicite:2]{index=2}
-        r.raise_for_status()
-        return r.json()
+    r = await http_client.get(url, headers=headers, timeout=6.0)
+    # Antideo uses standard error codes like 401 if key is wrong. :contentReference[oaicite:2]{index=2}
+    r.raise_for_status()
+    return r.json()
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=50,
+    minPoolSize=10,
+    serverSelectionTimeoutMS=3000,
+    waitQueueTimeoutMS=2000,
+    tz_aware=True,
+    uuidRepresentation="standard",
+)
 db = client[os.environ['DB_NAME']]
 
+# Redis connection (caches, counters, rate limits)
+redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+redis = Redis.from_url(redis_url, decode_responses=False)
+
+# Cache helpers fail open: a Redis outage falls back to Mongo instead of failing requests.
+# Only the key prefix is logged since keys can embed session tokens.
+async def cache_get(key: str):
+    try:
+        cached = await redis.get(key)
+    except Exception as e:
+        logger.warning(f"Redis get failed for {key.split(':', 1)[0]}: {e}")
+        return None
+    return orjson.loads(cached) if cached else None
+
+async def cache_set(key: str, value, ttl: int):
+    try:
+        await redis.setex(key, ttl, orjson.dumps(value))
+    except Exception as e:
+        logger.warning(f"Redis set failed for {key.split(':', 1)[0]}: {e}")
+
+async def cache_delete(key: str):
+    try:
+        await redis.delete(key)
+    except Exception as e:
+        logger.warning(f"Redis delete failed for {key.split(':', 1)[0]}: {e}")
+
+# Shared HTTP client (keep-alive pool for outbound API calls)
+http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=10.0,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+)
+
 # Create the main app
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -93,6 +162,9 @@ MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024  # 2GB
 PAYMENT_THRESHOLD = 200 * 1024 * 1024  # 200MB
 SUPPORTED_EXTENSIONS = ['mp4', 'mkv', 'avi', 'mov', 'mpeg', 'ogv', 'webm']
 OUTPUT_EXPIRY_DAYS = 7
+SESSION_TTL = timedelta(days=7)
+OTP_TTL = timedelta(minutes=10)
+OTP_MAX_ATTEMPTS = 5  # verify attempts per email per OTP_TTL window
 UPLOAD_DIR = Path("/tmp/video_uploads")
 OUTPUT_DIR = Path("/tmp/video_outputs")
 UPLOAD_DIR.mkdir(exist_ok=True)
@@ -107,61 +179,18 @@ class UserBase(BaseModel):
     picture: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
-class Video(BaseModel):
-    video_id: str = Field(default_factory=lambda: f"vid_{uuid.uuid4().hex[:12]}")
-    user_id: str
-    filename: str
-    size_bytes: int
-    extension: str
-    object_key: str
-    uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    payment_required: bool = False
-    payment_completed: bool = False
+# id schemes for documents created server-side
+def new_user_id() -> str:
+    return f"user_{uuid.uuid4().hex[:12]}"
 
-class Job(BaseModel):
-    job_id: str = Field(default_factory=lambda: f"job_{uuid.uuid4().hex[:12]}")
-    user_id: str
-    video_id: str
-    prompt_text: str
-    status: str = "queued"  # queued, processing, done, failed, expired
-    output_key: Optional[str] = None
-    output_expires_at: Optional[datetime] = None
-    error_message: Optional[str] = None
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    completed_at: Optional[datetime] = None
+def new_session_token() -> str:
+    return f"sess_{uuid.uuid4().hex}"
 
-class Payment(BaseModel):
-    payment_id: str = Field(default_factory=lambda: f"pay_{uuid.uuid4().hex[:12]}")
-    user_id: str
-    video_id: str
-    amount: float
-    currency: str = "INR"
-    mode: str  # one_time or subscription
-    status: str = "pending"  # pending, completed, failed
-    razorpay_order_id: Optional[str] = None
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+def new_video_id() -> str:
+    return f"vid_{uuid.uuid4().hex[:12]}"
 
-class Subscription(BaseModel):
-    subscription_id: str = Field(default_factory=lambda: f"sub_{uuid.uuid4().hex[:12]}")
-    user_id: str
-    plan: str  # monthly, annual
-    quota_bytes: int
-    used_bytes: int = 0
-    status: str = "active"  # active, cancelled, expired
-    razorpay_subscription_id: Optional[str] = None
-    starts_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    expires_at: datetime = None
-
-class DailyMetric(BaseModel):
-    date: str  # YYYY-MM-DD
-    visitors: int = 0
-    videos_processed: int = 0
-
-class OTPRecord(BaseModel):
-    email: str
-    otp: str
-    expires_at: datetime
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+def new_job_id() -> str:
+    return f"job_{uuid.uuid4().hex[:12]}"
 
 # ============== REQUEST/RESPONSE MODELS ==============
 
@@ -178,12 +207,6 @@ class UploadInitInput(BaseModel):
     ext: str
     video_id: Optional[str] = None
 
-class UploadInitResponse(BaseModel):
-    presigned_url: str
-    object_key: str
-    requires_payment: bool
-    quote: Optional[dict] = None
-
 class UploadCompleteInput(BaseModel):
     video_id: str
     object_key: str
@@ -202,14 +225,31 @@ class JobCreateInput(BaseModel):
     video_id: str
     prompt_text: str = Field(max_length=1000)
 
-class MetricsSummary(BaseModel):
-    lifetime_visitors: int
-    lifetime_videos_processed: int
-    today_visitors: int
-    today_videos_processed: int
-
 # ============== AUTH HELPERS ==============
 
+# Fields the app reads from a user doc (what /auth/me and the session cache carry)
+USER_PROJECTION = {"_id": 0, "user_id": 1, "email": 1, "name": 1, "picture": 1}
+SESSION_CACHE_TTL = 60  # seconds; bounds staleness if a session is removed out-of-band
+
+def session_cache_key(session_token: str) -> str:
+    return f"sess:{session_token}"
+
+async def cache_session_user(session_token: str, user: dict, expires_at: datetime):
+    """Cache the user doc for a session (short TTL, never past session expiry)"""
+    ttl = min(SESSION_CACHE_TTL, int((expires_at - datetime.now(timezone.utc)).total_seconds()))
+    if ttl > 0:
+        await cache_set(session_cache_key(session_token), user, ttl)
+
+def session_user_pipeline(session_token: str, now: datetime) -> list:
+    """Live session joined to its user in one round-trip; sessions without a user drop out"""
+    return [
+        {"$match": {"session_token": session_token, "expires_at": {"$gt": now}}},
+        {"$limit": 1},
+        {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "user_id", "as": "user"}},
+        {"$unwind": "$user"},
+        {"$project": {"_id": 0, "expires_at": 1, **{f"user.{k}": 1 for k in USER_PROJECTION if k != "_id"}}},
+    ]
+
 async def get_current_user(request: Request) -> dict:
     """Get current user from session token (cookie or header)"""
     session_token = request.cookies.get("session_token")
@@ -221,24 +261,36 @@ async def get_current_user(request: Request) -> dict:
     if not session_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    session = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0})
-    if not session:
-        raise HTTPException(status_code=401, detail="Invalid session")
+    cached = await cache_get(session_cache_key(session_token))
+    if cached:
+        return cached
     
-    expires_at = session.get("expires_at")
-    if isinstance(expires_at, str):
-        expires_at = datetime.fromisoformat(expires_at)
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
-    if expires_at < datetime.now(timezone.utc):
-        raise HTTPException(status_code=401, detail="Session expired")
-    
-    user = await db.users.find_one({"user_id": session["user_id"]}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
+    # expires_at is a BSON date; legacy string values never match and read as expired
+    docs = await db.user_sessions.aggregate(
+        session_user_pipeline(session_token, datetime.now(timezone.utc))
+    ).to_list(length=1)
+    if not docs:
+        raise HTTPException(status_code=401, detail="Invalid or expired session")
+    user, expires_at = docs[0]["user"], docs[0]["expires_at"]
     
+    await cache_session_user(session_token, user, expires_at)
     return user
 
+async def upsert_user(email: str, name: str, picture: Optional[str], now: datetime) -> dict:
+    """Get the user for an email, creating it on first login in the same round-trip"""
+    return await db.users.find_one_and_update(
+        {"email": email},
+        {"$setOnInsert": {
+            "user_id": new_user_id(),
+            "name": name,
+            "picture": picture,
+            "created_at": now.isoformat()
+        }},
+        projection=USER_PROJECTION,
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
 async def get_optional_user(request: Request) -> Optional[dict]:
     """Get current user if authenticated, None otherwise"""
     try:
@@ -246,55 +298,66 @@ async def get_optional_user(request: Request) -> Optional[dict]:
     except HTTPException:
         return None
 
+async def enforce_rate_limit(key: str, limit: int, window: int, detail: str = "Too many requests. Please try again later."):
+    """Fixed-window request counter in Redis; fails open if Redis is unavailable"""
+    try:
+        # INCR and EXPIRE ... NX in one MULTI: the key can never be left without a TTL
+        async with redis.pipeline(transaction=True) as pipe:
+            count, _ = await pipe.incr(key).expire(key, window, nx=True).execute()
+    except Exception as e:
+        logger.warning(f"Rate limit check skipped: {e}")
+        return
+    if count > limit:
+        raise HTTPException(status_code=429, detail=detail)
+
+def rate_limit_by_ip(name: str, limit: int, window: int = 60):
+    """Dependency limiting an endpoint to `limit` calls per client IP per `window` seconds"""
+    async def dependency(request: Request):
+        # real client IP only when uvicorn trusts the proxy (--forwarded-allow-ips, see README)
+        ip = request.client.host if request.client else "unknown"
+        await enforce_rate_limit(f"rl:{name}:{ip}", limit, window)
+    return dependency
+
 # ============== AUTH ENDPOINTS ==============
 
-@api_router.post("/auth/session")
+@api_router.post("/auth/session", dependencies=[Depends(rate_limit_by_ip("session", 20))])
 async def create_session(request: Request, response: Response):
     """Exchange session_id for session_token (Emergent Auth)"""
-    body = await request.json()
+    body = orjson.loads(await request.body())
     session_id = body.get("session_id")
     
     if not session_id:
         raise HTTPException(status_code=400, detail="session_id required")
     
     # Call Emergent Auth to get user data
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-            headers={"X-Session-ID": session_id}
-        )
-        if resp.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid session_id")
-        user_data = resp.json()
+    resp = await http_client.get(
+        "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
+        headers={"X-Session-ID": session_id}
+    )
+    if resp.status_code != 200:
+        raise HTTPException(status_code=401, detail="Invalid session_id")
+    user_data = resp.json()
     
-    user_id = f"user_{uuid.uuid4().hex[:12]}"
     email = user_data.get("email")
     name = user_data.get("name", "")
     picture = user_data.get("picture", "")
     session_token = user_data.get("session_token")
+    now = datetime.now(timezone.utc)
     
-    # Check if user exists
-    existing_user = await db.users.find_one({"email": email}, {"_id": 0})
-    if existing_user:
-        user_id = existing_user["user_id"]
-    else:
-        # Create new user
-        await db.users.insert_one({
-            "user_id": user_id,
-            "email": email,
-            "name": name,
-            "picture": picture,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+    # Create or get user
+    user = await upsert_user(email, name, picture, now)
+    user_id = user["user_id"]
     
     # Create session
-    expires_at = datetime.now(timezone.utc) + timedelta(days=7)
+    expires_at = now + SESSION_TTL
     await db.user_sessions.insert_one({
+        "_id": session_token,
         "user_id": user_id,
         "session_token": session_token,
-        "expires_at": expires_at.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "expires_at": expires_at,
+        "created_at": now.isoformat()
     })
+    await cache_session_user(session_token, user, expires_at)
     
     # Set cookie
     response.set_cookie(
@@ -306,7 +369,7 @@ async def create_session(request: Request, response: Response):
         #secure=True,
         #samesite="none",
         path="/",
-        max_age=7 * 24 * 60 * 60
+        max_age=int(SESSION_TTL.total_seconds())
     )
     
     return {"user_id": user_id, "email": email, "name": name, "picture": picture}
@@ -322,11 +385,14 @@ async def logout(request: Request, response: Response):
     session_token = request.cookies.get("session_token")
     if session_token:
         await db.user_sessions.delete_one({"session_token": session_token})
+        await cache_delete(session_cache_key(session_token))
     response.delete_cookie("session_token", path="/")
     return {"message": "Logged out"}
 
-@api_router.post("/auth/otp/request")
-async def request_otp(input: OTPRequestInput):
+@api_router.post("/auth/otp/request", dependencies=[Depends(rate_limit_by_ip("otp_request", 3))])
+async def request_otp(input: OTPRequestInput, background_tasks: BackgroundTasks):
+    # Per-account throttle (the IP limit alone doesn't stop distributed requests)
+    await enforce_rate_limit(f"otp_requests:{input.email}", 3, 60)
     # Antideo email health check (before OTP)
     if ENABLE_ANTIDEO_EMAIL_CHECK:
         try:
@@ -353,62 +419,51 @@ async def request_otp(input: OTPRequestInput):
             # Fail-open: do not block OTP if Antideo is down
             logging.warning(f"Antideo email check failed: {e}")
     otp = f"{secrets.randbelow(10**6):06d}"
-    expires_at = datetime.now(timezone.utc) + timedelta(minutes=10)
-
-    await db.otps.delete_many({"email": input.email})
-    await db.otps.insert_one({
-        "email": input.email,
-        "otp_hash": hash_otp(input.email, otp),
-        "expires_at": expires_at.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
 
-    await send_otp_email(input.email, otp)
+    # One pending OTP per email; a new request replaces it and Redis expires it
+    await redis.set(otp_key(input.email), hash_otp(input.email, otp), ex=OTP_TTL)
+
+    # send after the response so SendGrid latency isn't on the request path
+    background_tasks.add_task(send_otp_email_task, input.email, otp)
 
     return {"message": "OTP sent to email"}
 
 
-@api_router.post("/auth/otp/verify")
+@api_router.post("/auth/otp/verify", dependencies=[Depends(rate_limit_by_ip("otp_verify", 10))])
 async def verify_otp(input: OTPVerifyInput, response: Response):
     """Verify OTP and create session"""
-    otp_record = await db.otps.find_one({"email": input.email}, {"_id": 0})
-    if not otp_record:
-        raise HTTPException(status_code=400, detail="No OTP found for this email")
-    
-    expires_at = datetime.fromisoformat(otp_record["expires_at"])
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
-    
-    if expires_at < datetime.now(timezone.utc):
-        raise HTTPException(status_code=400, detail="OTP expired")
+    # Cap guesses per account so a 6-digit code can't be brute-forced across IPs
+    await enforce_rate_limit(
+        otp_attempts_key(input.email), OTP_MAX_ATTEMPTS, int(OTP_TTL.total_seconds()),
+        detail="Too many attempts. Please try again later."
+    )
+    now = datetime.now(timezone.utc)
+    stored_hash = await redis.get(otp_key(input.email))
+    if not stored_hash:
+        raise HTTPException(status_code=400, detail="OTP expired or not found. Please request a new one.")
     
-    if otp_record["otp_hash"] != hash_otp(input.email, input.otp):
+    if not hmac.compare_digest(stored_hash, hash_otp(input.email, input.otp).encode()):
         raise HTTPException(status_code=400, detail="Invalid OTP")
-    # Delete used OTP
-    await db.otps.delete_one({"email": input.email})
-    
-    # Create or get user
-    user_id = f"user_{uuid.uuid4().hex[:12]}"
-    existing_user = await db.users.find_one({"email": input.email}, {"_id": 0})
-    if existing_user:
-        user_id = existing_user["user_id"]
-    else:
-        await db.users.insert_one({
-            "user_id": user_id,
-            "email": input.email,
-            "name": input.email.split("@")[0],
-            "picture": None,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+    # Consume the OTP and create or get user in parallel
+    consumed, user = await asyncio.gather(
+        redis.delete(otp_key(input.email)),
+        upsert_user(input.email, input.email.split("@")[0], None, now),
+    )
+    if not consumed:
+        # a concurrent verify already used this OTP
+        raise HTTPException(status_code=400, detail="OTP expired or not found. Please request a new one.")
+    user_id = user["user_id"]
+    await cache_delete(otp_attempts_key(input.email))
     
     # Create session
-    session_token = f"sess_{uuid.uuid4().hex}"
-    expires_at = datetime.now(timezone.utc) + timedelta(days=7)
+    session_token = new_session_token()
+    expires_at = now + SESSION_TTL
     await db.user_sessions.insert_one({
+        "_id": session_token,
         "user_id": user_id,
         "session_token": session_token,
-        "expires_at": expires_at.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "expires_at": expires_at,
+        "created_at": now.isoformat()
     })
     
     # Set cookie
@@ -419,14 +474,15 @@ async def verify_otp(input: OTPVerifyInput, response: Response):
         secure=True,
         samesite="none",
         path="/",
-        max_age=7 * 24 * 60 * 60
+        max_age=int(SESSION_TTL.total_seconds())
     )
     
-    user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+    await cache_session_user(session_token, user, expires_at)
     return user
 
 # ============== UPLOAD ENDPOINTS ==============
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
 
 SPACES_REGION = os.environ.get("SPACES_REGION")
@@ -443,10 +499,20 @@ s3 = boto3.client(
     aws_secret_access_key=os.environ.get("SPACES_SECRET"),
     config=Config(
         signature_version="s3v4",
-        s3={"addressing_style": "virtual"}  # 🔥 THIS IS IMPORTANT
+        s3={"addressing_style": "virtual"},  # 🔥 THIS IS IMPORTANT
+        max_pool_connections=32,  # room for TRANSFER_CFG's parallel parts plus API calls
     ),
 )
 
+# Multipart transfers for job input/output: 16MB parts, 16 in flight
+TRANSFER_CFG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=16,
+    io_chunksize=1024 * 1024,
+    use_threads=True,
+)
+
 
 def presign_put(bucket: str, key: str, content_type: str, expires=3600):
     return s3.generate_presigned_url(
@@ -455,6 +521,18 @@ def presign_put(bucket: str, key: str, content_type: str, expires=3600):
         ExpiresIn=expires,
     )
 
+PRESIGN_PUT_EXPIRES = 60 * 15
+PRESIGN_CACHE_TTL = PRESIGN_PUT_EXPIRES - 60  # hand out URLs with at least a minute left
+
+def presign_cache_key(video_id: str) -> str:
+    return f"presign:{video_id}"
+
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9._-]")
+
+def safe_filename(filename: str) -> str:
+    """Replace anything outside [A-Za-z0-9._-] with "_" and cap the length for object keys"""
+    return _UNSAFE_FILENAME_CHARS.sub("_", filename)[:255]
+
 class UploadReserveInput(BaseModel):
     filename: str
     size_bytes: int
@@ -468,14 +546,15 @@ async def reserve_upload(input: UploadReserveInput, user: dict = Depends(get_cur
     if input.size_bytes > MAX_FILE_SIZE:
         raise HTTPException(status_code=400, detail="Unable to process files of this size at the moment.")
 
-    video_id = f"vid_{uuid.uuid4().hex[:12]}"
+    video_id = new_video_id()
     requires_payment = input.size_bytes > PAYMENT_THRESHOLD
     quote = calculate_quote(input.size_bytes, "one_time") if requires_payment else None
 
-    safe_name = "".join(ch if ch.isalnum() or ch in ("-", "_", ".") else "_" for ch in input.filename)
+    safe_name = safe_filename(input.filename)
     object_key = f"uploads/{user['user_id']}/{video_id}_{safe_name}"
 
     video = {
+        "_id": video_id,
         "video_id": video_id,
         "user_id": user["user_id"],
         "filename": safe_name,
@@ -500,8 +579,9 @@ async def reserve_upload(input: UploadReserveInput, user: dict = Depends(get_cur
     }
 
 
-@api_router.post("/uploads/init", response_model=UploadInitResponse)
+@api_router.post("/uploads/init")
 async def init_upload(input: UploadInitInput, request: Request, user: dict = Depends(get_current_user)):
+    """Returns presigned_url (None while payment is pending), object_key, requires_payment, quote"""
     logger.info(f"[Init Upload Checking pay first mode {PAY_FIRST_MODE}")
     # If PAY_FIRST_MODE: require a reserved video_id
     if PAY_FIRST_MODE:
@@ -516,12 +596,12 @@ async def init_upload(input: UploadInitInput, request: Request, user: dict = Dep
         # hard block upload until paid (only when payment is required)
         if video.get("payment_required") and not video.get("payment_completed"):
             quote = calculate_quote(video["size_bytes"], "one_time")
-            return UploadInitResponse(
-                presigned_url=None,
-                object_key=video["object_key"],
-                requires_payment=True,
-                quote=quote
-            )
+            return {
+                "presigned_url": None,
+                "object_key": video["object_key"],
+                "requires_payment": True,
+                "quote": quote
+            }
 
         object_key = video["object_key"]
         size_bytes = video["size_bytes"]
@@ -533,79 +613,106 @@ async def init_upload(input: UploadInitInput, request: Request, user: dict = Dep
             raise HTTPException(status_code=400, detail="Unsupported extension")
         if input.size_bytes > MAX_FILE_SIZE:
             raise HTTPException(status_code=400, detail="Unable to process files of this size at the moment.")
-        safe_name = "".join(ch if ch.isalnum() or ch in ("-", "_", ".") else "_" for ch in input.filename)
+        safe_name = safe_filename(input.filename)
         object_key = f"uploads/{user['user_id']}/{uuid.uuid4().hex}_{safe_name}"
         size_bytes = input.size_bytes
 
-    presigned_url = s3.generate_presigned_url(
-        ClientMethod="put_object",
-        Params={"Bucket": SPACES_BUCKET, "Key": object_key},
-        ExpiresIn=60 * 15,
-    )
+    # reserved keys are stable, so retried inits can reuse the signed URL
+    presigned_url = await cache_get(presign_cache_key(input.video_id)) if PAY_FIRST_MODE else None
+    if not presigned_url:
+        presigned_url = await asyncio.to_thread(
+            s3.generate_presigned_url,
+            ClientMethod="put_object",
+            Params={"Bucket": SPACES_BUCKET, "Key": object_key},
+            ExpiresIn=PRESIGN_PUT_EXPIRES,
+        )
+        if PAY_FIRST_MODE:
+            await cache_set(presign_cache_key(input.video_id), presigned_url, PRESIGN_CACHE_TTL)
 
     requires_payment = size_bytes > PAYMENT_THRESHOLD
     quote = calculate_quote(size_bytes, "one_time") if requires_payment else None
 
-    return UploadInitResponse(
-        presigned_url=presigned_url,
-        object_key=object_key,
-        requires_payment=requires_payment,
-        quote=quote
-    )
+    return {
+        "presigned_url": presigned_url,
+        "object_key": object_key,
+        "requires_payment": requires_payment,
+        "quote": quote
+    }
 
 
 @api_router.post("/uploads/complete")
 async def complete_upload(input: UploadCompleteInput, user: dict = Depends(get_current_user)):
 
+    # only accept keys under this user's upload prefix
+    if not input.object_key.startswith(f"uploads/{user['user_id']}/"):
+        raise HTTPException(status_code=400, detail="Invalid object_key")
+
     # verify exists in Spaces
     try:
-        s3.head_object(Bucket=SPACES_BUCKET, Key=input.object_key)
+        head = await asyncio.to_thread(s3.head_object, Bucket=SPACES_BUCKET, Key=input.object_key)
     except Exception:
         raise HTTPException(status_code=400, detail="Upload not found in storage. Please retry upload.")
 
-    video = await db.videos.find_one({"video_id": input.video_id, "user_id": user["user_id"]})
-    if not video:
-        raise HTTPException(status_code=404, detail="Video not found")
+    # trust the stored size, not the client-declared one
+    size_bytes = head["ContentLength"]
+    if size_bytes > MAX_FILE_SIZE:
+        await asyncio.to_thread(s3.delete_object, Bucket=SPACES_BUCKET, Key=input.object_key)
+        raise HTTPException(status_code=413, detail="Unable to process files of this size at the moment.")
 
+    video_filter = {"video_id": input.video_id, "user_id": user["user_id"]}
     # (Optional) in pay-first mode ensure key matches reserved
-    if PAY_FIRST_MODE and video.get("object_key") != input.object_key:
-        raise HTTPException(status_code=400, detail="object_key mismatch")
-
-    await db.videos.update_one(
-        {"video_id": input.video_id, "user_id": user["user_id"]},
-        {"$set": {
-            "uploaded_at": datetime.now(timezone.utc).isoformat(),
-            "upload_status": "uploaded",
-            "size_bytes": input.size_bytes,
-            "payment_required": input.size_bytes > PAYMENT_THRESHOLD,
-            "payment_completed": video.get("payment_completed", False) or (input.size_bytes <= PAYMENT_THRESHOLD)
-        }}
-    )
+    key_filter = {"object_key": input.object_key} if PAY_FIRST_MODE else {}
+
+    fields = {
+        "uploaded_at": datetime.now(timezone.utc).isoformat(),
+        "upload_status": "uploaded",
+        "size_bytes": size_bytes,
+        "payment_required": size_bytes > PAYMENT_THRESHOLD,
+    }
+    if size_bytes <= PAYMENT_THRESHOLD:
+        # small files never need payment; larger ones keep their existing payment state
+        fields["payment_completed"] = True
+
+    # check-and-set in one atomic round-trip
+    result = await db.videos.update_one({**video_filter, **key_filter}, {"$set": fields})
+    if not result.matched_count:
+        # error path only: tell a wrong key apart from a missing video
+        if key_filter and await db.videos.find_one(video_filter, {"_id": 1}):
+            raise HTTPException(status_code=400, detail="object_key mismatch")
+        raise HTTPException(status_code=404, detail="Video not found")
 
-    return {"video_id": input.video_id, "payment_required": input.size_bytes > PAYMENT_THRESHOLD}
+    await cache_delete(presign_cache_key(input.video_id))
+    return {"video_id": input.video_id, "payment_required": size_bytes > PAYMENT_THRESHOLD}
 
 
 # ============== BILLING ENDPOINTS ==============
 
+ONE_TIME_TIER_AMOUNTS = (49, 99, 149)  # INR for <=500MB, <=1000MB, larger
+
+def size_tier(size_bytes: int) -> int:
+    size_mb = size_bytes / (1024 * 1024)
+    if size_mb <= 500:
+        return 0
+    if size_mb <= 1000:
+        return 1
+    return 2
+
+@lru_cache(maxsize=8)
+def _quote_items(tier: int, mode: str) -> tuple:
+    """Immutable pricing for a size tier; calculate_quote hands out fresh dicts"""
+    if mode == "one_time":
+        return (("amount", ONE_TIME_TIER_AMOUNTS[tier]), ("currency", "INR"), ("mode", "one_time"))
+    # Subscription pricing
+    return (
+        ("monthly", (("amount", 299), ("currency", "INR"), ("quota_gb", 10))),
+        ("annual", (("amount", 2499), ("currency", "INR"), ("quota_gb", 150))),
+    )
+
 def calculate_quote(size_bytes: int, mode: str) -> dict:
     """Calculate pricing based on size and mode"""
-    size_mb = size_bytes / (1024 * 1024)
-    
     if mode == "one_time":
-        # Tier pricing
-        if size_mb <= 500:
-            amount = 49
-        elif size_mb <= 1000:
-            amount = 99
-        else:
-            amount = 149
-        return {"amount": amount, "currency": "INR", "mode": "one_time"}
-    else:
-        # Subscription pricing
-        return {
-            "monthly": {"amount": 299, "currency": "INR", "quota_gb": 10},
-            "annual": {"amount": 2499, "currency": "INR", "quota_gb": 150}
-        }
+        return dict(_quote_items(size_tier(size_bytes), mode))
+    return {plan: dict(items) for plan, items in _quote_items(0, mode)}
 
 @api_router.post("/billing/quote")
 async def get_quote(input: BillingQuoteInput, user: dict = Depends(get_current_user)):
@@ -628,7 +735,7 @@ async def create_checkout(input: BillingCheckoutInput, user: dict = Depends(get_
     quote = calculate_quote(video["size_bytes"], input.mode)
 
     if input.mode == "one_time":
-        order = client_rzp.order.create({
+        order = await asyncio.to_thread(client_rzp.order.create, {
             "amount": int(quote["amount"] * 100),  # paise
             "currency": "INR",
             "receipt": f"{input.video_id}",
@@ -654,27 +761,36 @@ async def create_checkout(input: BillingCheckoutInput, user: dict = Depends(get_
 
     raise HTTPException(status_code=400, detail="Unsupported mode")
 
-import hmac, hashlib
+RAZORPAY_WEBHOOK_SECRET = os.environ["RAZORPAY_WEBHOOK_SECRET"].encode()
 
-def verify_razorpay_signature(body: bytes, signature: str, secret: str) -> bool:
-    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
-    return hmac.compare_digest(expected, signature)
+def verify_razorpay_signature(body: bytes, signature: str, secret: bytes) -> bool:
+    # compare raw digests: one fromhex on the header instead of hex-encoding ours
+    try:
+        sig = bytes.fromhex(signature)
+    except ValueError:
+        return False
+    expected = hmac.new(secret, body, hashlib.sha256).digest()
+    return hmac.compare_digest(expected, sig)
 
 @api_router.post("/billing/webhook")
 async def billing_webhook(request: Request):
     body = await request.body()
     signature = request.headers.get("X-Razorpay-Signature", "")
-    if not verify_razorpay_signature(body, signature, os.environ["RAZORPAY_WEBHOOK_SECRET"]):
+    if not verify_razorpay_signature(body, signature, RAZORPAY_WEBHOOK_SECRET):
         raise HTTPException(status_code=401, detail="Invalid signature")
 
-    payload = await request.json()
+    payload = orjson.loads(body)
     event = payload.get("event")
 
     if event == "payment.captured":
         order_id = payload["payload"]["payment"]["entity"]["order_id"]
-        payment = await db.payments.find_one({"razorpay_order_id": order_id})
+        # Flip pending -> completed atomically; redelivered webhooks match nothing
+        payment = await db.payments.find_one_and_update(
+            {"razorpay_order_id": order_id, "status": "pending"},
+            {"$set": {"status": "completed"}},
+            projection={"video_id": 1, "_id": 0}
+        )
         if payment:
-            await db.payments.update_one({"razorpay_order_id": order_id}, {"$set": {"status": "completed"}})
             await db.videos.update_one({"video_id": payment["video_id"]}, {"$set": {"payment_completed": True}})
     return {"status": "ok"}
 
@@ -686,19 +802,7 @@ class BillingVerifyInput(BaseModel):
 
 @api_router.post("/billing/verify")
 async def verify_payment(input: BillingVerifyInput, user: dict = Depends(get_current_user)):
-    # 1) Ensure payment record exists and belongs to this user/video
-    payment = await db.payments.find_one({
-        "razorpay_order_id": input.razorpay_order_id,
-        "user_id": user["user_id"],
-        "video_id": input.video_id,
-    })
-    if not payment:
-        raise HTTPException(status_code=404, detail="Payment record not found")
-
-    if payment.get("status") == "completed":
-        return {"status": "already_completed"}
-
-    # 2) Verify signature (order_id|payment_id with key_secret)
+    # 1) Verify signature (order_id|payment_id with key_secret) - local HMAC, rejects forgeries before any I/O
     try:
         client_rzp.utility.verify_payment_signature({
             "razorpay_order_id": input.razorpay_order_id,
@@ -708,8 +812,23 @@ async def verify_payment(input: BillingVerifyInput, user: dict = Depends(get_cur
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid payment signature")
 
-    # 3) Optional but strong: confirm payment is captured and amount matches
-    rp_payment = client_rzp.payment.fetch(input.razorpay_payment_id)
+    # 2) Ensure payment record exists and belongs to this user/video, while
+    #    fetching the Razorpay payment (blocking SDK call, so in a thread)
+    payment, rp_payment = await asyncio.gather(
+        db.payments.find_one({
+            "razorpay_order_id": input.razorpay_order_id,
+            "user_id": user["user_id"],
+            "video_id": input.video_id,
+        }),
+        asyncio.to_thread(client_rzp.payment.fetch, input.razorpay_payment_id),
+    )
+    if not payment:
+        raise HTTPException(status_code=404, detail="Payment record not found")
+
+    if payment.get("status") == "completed":
+        return {"status": "already_completed"}
+
+    # 3) Confirm payment is captured and amount matches
     if rp_payment.get("status") != "captured":
         raise HTTPException(status_code=400, detail=f"Payment not captured: {rp_payment.get('status')}")
 
@@ -719,13 +838,15 @@ async def verify_payment(input: BillingVerifyInput, user: dict = Depends(get_cur
         raise HTTPException(status_code=400, detail="Amount mismatch")
 
     # 4) Mark completed
-    await db.payments.update_one(
-        {"razorpay_order_id": input.razorpay_order_id},
-        {"$set": {"status": "completed", "razorpay_payment_id": input.razorpay_payment_id}}
-    )
-    await db.videos.update_one(
-        {"video_id": input.video_id, "user_id": user["user_id"]},
-        {"$set": {"payment_completed": True}}
+    await asyncio.gather(
+        db.payments.update_one(
+            {"razorpay_order_id": input.razorpay_order_id},
+            {"$set": {"status": "completed", "razorpay_payment_id": input.razorpay_payment_id}}
+        ),
+        db.videos.update_one(
+            {"video_id": input.video_id, "user_id": user["user_id"]},
+            {"$set": {"payment_completed": True}}
+        ),
     )
 
     return {"status": "ok", "video_id": input.video_id}
@@ -733,6 +854,41 @@ async def verify_payment(input: BillingVerifyInput, user: dict = Depends(get_cur
 
 # ============== JOB ENDPOINTS ==============
 
+# One directive per "."-separated sentence, e.g. "Keep: 00:00-00:10. Order: 1. Output: mp4."
+# A "." followed by a digit is a fractional timestamp ("00:01.5"), not a sentence break.
+_DIRECTIVE = re.compile(r"(?:^|\.)\s*(?P<key>keep|order|output|quality)\s*:(?P<val>(?:[^.]|\.(?=\d))*)", re.IGNORECASE)
+_SEGMENT = re.compile(r"\s*([^-]+?)\s*-\s*([^-]+?)\s*")
+
+def _parse_keep(result: dict, val: str):
+    # index is the 1-based position in the comma list, matching Order:
+    for i, part in enumerate(val.split(',')):
+        seg = _SEGMENT.fullmatch(part)
+        if seg:
+            result["segments"].append({
+                "index": i + 1,
+                "start": seg.group(1),
+                "end": seg.group(2)
+            })
+
+def _parse_order(result: dict, val: str):
+    try:
+        result["order"] = [int(x) for x in val.split(',')]
+    except ValueError:
+        pass
+
+def _parse_output(result: dict, val: str):
+    result["output_format"] = val.lower()
+
+def _parse_quality(result: dict, val: str):
+    result["quality"] = val.lower()
+
+_HANDLERS = {
+    "keep": _parse_keep,
+    "order": _parse_order,
+    "output": _parse_output,
+    "quality": _parse_quality,
+}
+
 def parse_prompt(prompt_text: str) -> dict:
     """Parse prompt into segments and order"""
     result = {
@@ -742,34 +898,11 @@ def parse_prompt(prompt_text: str) -> dict:
         "quality": "medium"
     }
     
-    lines = prompt_text.strip().split('.')
-    for line in lines:
-        line = line.strip()
-        if line.lower().startswith("keep:"):
-            # Parse segments
-            segments_str = line[5:].strip()
-            parts = [p.strip() for p in segments_str.split(',')]
-            for i, part in enumerate(parts):
-                if '-' in part:
-                    times = part.split('-')
-                    if len(times) == 2:
-                        result["segments"].append({
-                            "index": i + 1,
-                            "start": times[0].strip(),
-                            "end": times[1].strip()
-                        })
-        elif line.lower().startswith("order:"):
-            order_str = line[6:].strip()
-            try:
-                result["order"] = [int(x.strip()) for x in order_str.split(',')]
-            except:
-                pass
-        elif line.lower().startswith("output:"):
-            result["output_format"] = line[7:].strip().lower()
-        elif line.lower().startswith("quality:"):
-            result["quality"] = line[8:].strip().lower()
+    for m in _DIRECTIVE.finditer(prompt_text):
+        _HANDLERS[m.group("key").lower()](result, m.group("val").strip())
     
     # Default order if not specified
+    if not result["order"]:
         result["order"] = [s["index"] for s in result["segments"]]
     
     return result
@@ -800,11 +933,282 @@ def quality_to_crf(quality: str) -> int:
     # lower CRF = higher quality / larger file
     return {"high": 20, "medium": 23, "low": 28}.get(q, 23)
 
+# FFMPEG_HWACCEL=nvenc encodes on the GPU when one is usable; decode/trim stay in software
+FFMPEG_HWACCEL = os.environ.get("FFMPEG_HWACCEL", "").lower()
+nvenc_available = False
+
+async def detect_nvenc() -> bool:
+    """Encode one tiny frame with h264_nvenc; listing encoders doesn't prove a GPU is present"""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", "color=black:s=256x256",
+            "-frames:v", "1", "-c:v", "h264_nvenc", "-f", "null", "-",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        return await proc.wait() == 0
+    except OSError:
+        return False
+
+def quality_to_preset(quality: str) -> str:
+    q = (quality or "medium").lower()
+    # draft renders trade a little efficiency for a much faster encode
+    return "veryfast" if q in ("draft", "preview") else "medium"
+
+# x264 preset -> closest NVENC preset (p1 fastest .. p7 slowest)
+NVENC_PRESETS = {"veryfast": "p2", "medium": "p4"}
+
+def video_encode_args(crf: int, preset: str = "medium") -> list:
+    if nvenc_available:
+        # -cq is NVENC's constant-quality knob; same scale as x264 CRF
+        return ["-c:v", "h264_nvenc", "-preset", NVENC_PRESETS.get(preset, "p4"), "-rc", "vbr", "-cq", str(crf), "-b:v", "0"]
+    return ["-c:v", "libx264", "-preset", preset, "-crf", str(crf)]
+
+STDERR_TAIL_LINES = 200
+PROGRESS_INTERVAL = 1.0  # seconds between progress callbacks
+_STDERR_LINE_BREAK = re.compile(rb"[\r\n]")
+_FFMPEG_TIME = re.compile(rb"time=(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+async def drain_stderr(stream, tail: deque, on_progress=None):
+    """Read ffmpeg stderr as it arrives: keep the last lines for errors, turn stats lines into progress"""
+    loop = asyncio.get_running_loop()
+    last_report = 0.0
+    pending = b""
+    while chunk := await stream.read(64 * 1024):
+        # stats lines end in \r, everything else in \n
+        *lines, pending = _STDERR_LINE_BREAK.split(pending + chunk)
+        for line in lines:
+            m = _FFMPEG_TIME.search(line)
+            if not m:
+                if line:
+                    tail.append(line)
+                continue
+            if on_progress and loop.time() - last_report >= PROGRESS_INTERVAL:
+                last_report = loop.time()
+                hh, mm, ss = m.groups()
+                try:
+                    await on_progress(int(hh) * 3600 + int(mm) * 60 + float(ss))
+                except Exception as e:
+                    logger.warning(f"Progress update failed: {e}")
+    if pending:
+        tail.append(pending)
+
+# presigned URLs (FFMPEG_STREAM_INPUT) carry credentials in the query string
+_SIGNED_URL_QUERY = re.compile(r"(https?://[^\s?'\"]+)\?[^\s'\"]*")
+
+def redact_urls(text: str) -> str:
+    return _SIGNED_URL_QUERY.sub(r"\1", text)
+
+def stderr_message(tail: deque) -> str:
+    """Error text for the job record; ffmpeg echoes its input URL, so signatures are stripped"""
+    return redact_urls(b"\n".join(tail).decode(errors="ignore"))[-2000:]
+
+def log_cmd(cmd: list):
+    """Full command lines at DEBUG only; presigned URLs lose their signing query string"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("run: %s", redact_urls(" ".join(cmd)))
+
+async def run_tool(cmd: list, on_progress=None) -> bytes:
+    """Run ffmpeg/ffprobe to completion; returns stdout, raises with the stderr tail on failure"""
+    log_cmd(cmd)
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+    out, _ = await asyncio.gather(proc.stdout.read(), drain_stderr(proc.stderr, tail, on_progress))
+    await proc.wait()
+    if proc.returncode != 0:
+        raise RuntimeError(f"{cmd[0]} failed: {stderr_message(tail)}")
+    return out
+
+KEYFRAME_TOLERANCE = 0.05  # seconds; a cut this close to a keyframe can be stream-copied
+
+DURATION_TOLERANCE = 0.05  # seconds; containers round the reported duration
+
+async def probe_media(input_src: str) -> dict:
+    """One ffprobe pass for container duration and which stream types exist"""
+    info = orjson.loads(await run_tool([
+        "ffprobe", "-v", "error",
+        "-print_format", "json",
+        "-show_format", "-show_streams",
+        input_src
+    ]))
+    codec_types = {st.get("codec_type") for st in info.get("streams", [])}
+    return {
+        "duration": float(info.get("format", {}).get("duration") or 0),
+        "has_video": "video" in codec_types,
+        "has_audio": "audio" in codec_types,
+    }
+
+def check_spans(spans: list, media: dict):
+    """Fail before encoding if the input can't satisfy the requested cuts"""
+    if not media["has_video"]:
+        raise RuntimeError("Input has no video stream")
+    duration = media["duration"]
+    for s, e in spans:
+        if duration and e > duration + DURATION_TOLERANCE:
+            raise RuntimeError(f"Segment {s:g}-{e:g}s is past the end of the video ({duration:.2f}s)")
+
+async def keyframe_times(input_src: str, spans: list) -> list:
+    """Keyframe timestamps near each span start, from packet flags (no decode, only short reads)"""
+    starts = sorted({s for s, _ in spans})
+    intervals = ",".join(f"{max(0.0, s - KEYFRAME_TOLERANCE)}%+{2 * KEYFRAME_TOLERANCE}" for s in starts)
+    out = await run_tool([
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-read_intervals", intervals,
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        input_src
+    ])
+    times = set()
+    for line in out.decode(errors="ignore").splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" not in flags:
+            continue
+        try:
+            times.add(float(pts))
+        except ValueError:
+            pass  # N/A
+    return sorted(times)
+
+def snap_to_keyframes(spans: list, keyframes: list) -> Optional[list]:
+    """Spans with each start moved onto the keyframe within tolerance of it, or None if any start has none.
+
+    A copy cut must begin exactly on a keyframe: input -ss seeks back to the keyframe at or
+    before the requested time, so a start just short of a keyframe would pull in the whole previous GOP.
+    """
+    snapped = []
+    for s, e in spans:
+        window = keyframes[
+            bisect.bisect_left(keyframes, s - KEYFRAME_TOLERANCE):bisect.bisect_right(keyframes, s + KEYFRAME_TOLERANCE)
+        ]
+        if not window:
+            return None
+        snapped.append((min(window, key=lambda k: abs(k - s)), e))
+    return snapped
+
+# first video + first audio (if any) only; phone .mov data/timecode tracks can't be muxed
+OUTPUT_STREAM_MAP = ["-map", "0:v:0", "-map", "0:a:0?"]
+
+def cut_cmd(input_src: str, span: tuple, video_args: Optional[list]) -> list:
+    """ffmpeg args (minus output) for one span: stream copy when video_args is None, else a frame-accurate re-encode"""
+    s, e = span
+    cmd = ["ffmpeg", "-y", "-ss", str(s), "-i", input_src, "-t", str(e - s), *OUTPUT_STREAM_MAP]
+    if video_args is None:
+        return cmd + ["-c", "copy", "-avoid_negative_ts", "make_zero"]
+    return cmd + [
+        *video_args,
+        "-threads", str(FFMPEG_THREADS),
+        "-c:a", "aac",
+        "-b:a", "128k",
+    ]
+
+async def copy_segment(input_src: str, span: tuple, part: Path):
+    """Cut a keyframe-aligned span without re-encoding (one FFMPEG_SEM slot per process)"""
+    async with FFMPEG_SEM:
+        await run_tool(cut_cmd(input_src, span, None) + [str(part)])
+
+async def encode_segment(input_src: str, span: tuple, video_args: list, part: Path, on_progress=None):
+    """Re-encode one span to an MPEG-TS part that concats losslessly"""
+    await run_tool(cut_cmd(input_src, span, video_args) + ["-f", "mpegts", str(part)], on_progress)
+
+async def write_concat_list(parts: list, path: Path):
+    async with aiofiles.open(path, "w") as f:
+        await f.write("".join(f"file '{part}'\n" for part in parts))
+
+# uvicorn workers on this host (uvicorn reads WEB_CONCURRENCY as its --workers default);
+# each worker has its own FFMPEG_SEM, so the cores are split across all of them
+WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+WORKER_CPUS = max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)
+# encodes allowed at once per worker; each gets an equal share of the worker's cores
+FFMPEG_CONCURRENCY = max(1, int(os.environ.get("FFMPEG_CONCURRENCY", WORKER_CPUS // 4)))
+FFMPEG_THREADS = max(1, WORKER_CPUS // FFMPEG_CONCURRENCY)
+FFMPEG_SEM = asyncio.Semaphore(FFMPEG_CONCURRENCY)
+
+# FFMPEG_STREAM_INPUT=1 feeds ffmpeg a presigned GET URL instead of staging the input on disk
+FFMPEG_STREAM_INPUT = os.environ.get("FFMPEG_STREAM_INPUT", "0") == "1"
+INPUT_URL_EXPIRES = 6 * 60 * 60  # outlives the longest encode
+
+S3_PART_SIZE = 16 * 1024 * 1024
+S3_PARTS_IN_FLIGHT = 4  # bounds buffered output to ~64MB per job
+# containers ffmpeg can write to a pipe as fragmented MP4 (moov up front, no seek back)
+PIPE_OUTPUT_FORMATS = ("mp4", "mov")
+
+async def encode_to_s3(cmd: list, bucket: str, key: str, on_progress=None) -> int:
+    """Run ffmpeg with output on stdout and stream it into a multipart upload; returns bytes written"""
+    log_cmd(cmd)
+    upload_id = (await asyncio.to_thread(s3.create_multipart_upload, Bucket=bucket, Key=key))["UploadId"]
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    # drain stderr alongside stdout so a chatty ffmpeg can't block on a full pipe
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+    stderr_task = asyncio.create_task(drain_stderr(proc.stderr, tail, on_progress))
+    in_flight = asyncio.Semaphore(S3_PARTS_IN_FLIGHT)
+    part_tasks = []
+    total = 0
+
+    async def upload_part(number: int, body: bytes) -> dict:
+        try:
+            resp = await asyncio.to_thread(
+                s3.upload_part, Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body
+            )
+        finally:
+            in_flight.release()
+        return {"PartNumber": number, "ETag": resp["ETag"]}
+
+    try:
+        while True:
+            try:
+                chunk = await proc.stdout.readexactly(S3_PART_SIZE)
+            except asyncio.IncompleteReadError as e:
+                chunk = e.partial
+            if not chunk:
+                break
+            total += len(chunk)
+            await in_flight.acquire()
+            part_tasks.append(asyncio.create_task(upload_part(len(part_tasks) + 1, chunk)))
+            if len(chunk) < S3_PART_SIZE:
+                break
+
+        await proc.wait()
+        await stderr_task
+        parts = await asyncio.gather(*part_tasks)
+        if proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr_message(tail)}")
+        if not total:
+            raise RuntimeError("Output not created / empty")
+
+        await asyncio.to_thread(
+            s3.complete_multipart_upload,
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+        return total
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        stderr_task.cancel()
+        for task in part_tasks:
+            task.cancel()
+        await asyncio.gather(*part_tasks, return_exceptions=True)
+        try:
+            await asyncio.to_thread(s3.abort_multipart_upload, Bucket=bucket, Key=key, UploadId=upload_id)
+        except Exception as e:
+            logger.warning(f"abort_multipart_upload failed for {key}: {e}")
+        raise
+
 async def head_with_retry(bucket: str, key: str, attempts: int = 6):
     delay = 0.4
     for _ in range(attempts):
         try:
-            s3.head_object(Bucket=bucket, Key=key)
+            await asyncio.to_thread(s3.head_object, Bucket=bucket, Key=key)
             return
         except ClientError as e:
             code = e.response.get("Error", {}).get("Code")
@@ -815,11 +1219,237 @@ async def head_with_retry(bucket: str, key: str, attempts: int = 6):
             raise
     raise RuntimeError(f"Object not found after retries: {key}")
 
+# rendered outputs and segments under cache/ are reusable but disposable; Spaces expires them
+RENDER_CACHE_PREFIX = "cache/"
+RENDER_CACHE_DAYS = int(os.environ.get("RENDER_CACHE_DAYS", 14))
+RENDER_CACHE_RULE_ID = "expire-render-cache"
+
+def ensure_render_cache_lifecycle():
+    """Add (or update) the bucket lifecycle rule expiring cache/, keeping any other rules"""
+    try:
+        rules = s3.get_bucket_lifecycle_configuration(Bucket=SPACES_BUCKET).get("Rules", [])
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "NoSuchLifecycleConfiguration":
+            raise
+        rules = []
+    rule = {
+        "ID": RENDER_CACHE_RULE_ID,
+        "Status": "Enabled",
+        "Filter": {"Prefix": RENDER_CACHE_PREFIX},
+        "Expiration": {"Days": RENDER_CACHE_DAYS},
+    }
+    if rule in rules:
+        return
+    rules = [r for r in rules if r.get("ID") != RENDER_CACHE_RULE_ID] + [rule]
+    s3.put_bucket_lifecycle_configuration(Bucket=SPACES_BUCKET, LifecycleConfiguration={"Rules": rules})
+
+def output_cache_key(video_id: str, spans: list, out_fmt: str, video_args: list) -> str:
+    digest = hashlib.sha1(repr((spans, out_fmt, video_args)).encode()).hexdigest()
+    return f"{RENDER_CACHE_PREFIX}{video_id}/{digest}.{out_fmt}"
+
+def segment_cache_key(video_id: str, span: tuple, video_args: list) -> str:
+    digest = hashlib.sha1(repr((span, video_args)).encode()).hexdigest()
+    return f"{RENDER_CACHE_PREFIX}{video_id}/segments/{digest}.ts"
+
+async def download_if_exists(key: str, path: Path) -> bool:
+    try:
+        await asyncio.to_thread(s3.download_file, SPACES_BUCKET, key, str(path), Config=TRANSFER_CFG)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return True
+
+async def render_segment(input_src: str, span: tuple, video_args: list, part: Path, cache_key: str, on_progress=None) -> bool:
+    """Fetch an already-encoded span from the segment cache, or encode it; True if it was encoded"""
+    if await download_if_exists(cache_key, part):
+        return False
+    async with FFMPEG_SEM:
+        await encode_segment(input_src, span, video_args, part, on_progress)
+    return True
+
+# strong refs so fire-and-forget cache uploads aren't garbage collected mid-flight
+segment_store_tasks = set()
+
+async def store_segments(parts: list):
+    """Upload freshly encoded (part, cache_key) pairs to the segment cache, then drop the local files"""
+    for part, cache_key in parts:
+        try:
+            await asyncio.to_thread(s3.upload_file, str(part), SPACES_BUCKET, cache_key, Config=TRANSFER_CFG)
+        except Exception as e:
+            logger.warning(f"Segment cache store failed for {cache_key}: {e}")
+        finally:
+            part.unlink(missing_ok=True)
+
+async def copy_object_if_exists(src_key: str, dst_key: str) -> bool:
+    """Server-side copy within the bucket; False if src_key doesn't exist"""
+    try:
+        await asyncio.to_thread(
+            s3.copy_object,
+            Bucket=SPACES_BUCKET, Key=dst_key, CopySource={"Bucket": SPACES_BUCKET, "Key": src_key}
+        )
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return True
+
+JOB_CACHE_TTL = 10  # seconds; job writes also invalidate explicitly
+
+def job_cache_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+async def update_job(job_id: str, fields: dict):
+    """Update job fields and drop the cached copy that clients poll"""
+    await db.jobs.update_one({"job_id": job_id}, {"$set": fields})
+    await cache_delete(job_cache_key(job_id))
+
+async def find_user_job(job_id: str, user_id: str) -> Optional[dict]:
+    """Get a job owned by user_id, served from Redis when recently read"""
+    job = await cache_get(job_cache_key(job_id))
+    if job:
+        return job if job.get("user_id") == user_id else None
+    job = await db.jobs.find_one({"job_id": job_id, "user_id": user_id}, {"_id": 0})
+    if job:
+        await cache_set(job_cache_key(job_id), job, JOB_CACHE_TTL)
+    return job
+
+async def file_size(path: Path) -> int:
+    """Size in bytes from a single stat; 0 if the file is missing"""
+    try:
+        return (await aiofiles.os.stat(path)).st_size
+    except FileNotFoundError:
+        return 0
+
+async def render_output(job_id: str, video_id: str, input_key: str, input_ext: str, spans: list, out_fmt: str,
+                        video_args: list, output_key: str, temp_paths: list):
+    """Cut spans out of the input and put the result at output_key"""
+    input_path = UPLOAD_DIR / f"{job_id}_input.{input_ext}"
+    output_path = OUTPUT_DIR / f"{job_id}_output.{out_fmt}"
+    temp_paths += [input_path, output_path]
+
+    # ensure the object is readable (Spaces consistency / race)
+    await head_with_retry(SPACES_BUCKET, input_key)
+
+    if FFMPEG_STREAM_INPUT:
+        # ffmpeg range-reads the object over HTTPS, so moov-at-end uploads still work
+        input_src = await asyncio.to_thread(
+            s3.generate_presigned_url,
+            ClientMethod="get_object",
+            Params={"Bucket": SPACES_BUCKET, "Key": input_key},
+            ExpiresIn=INPUT_URL_EXPIRES,
+        )
+        logger.info(f"[JOB {job_id}] streaming input from {input_key}")
+    else:
+        logger.info(f"[JOB {job_id}] download to {input_path}")
+
+        # download from Spaces
+        await asyncio.to_thread(s3.download_file, SPACES_BUCKET, input_key, str(input_path), Config=TRANSFER_CFG)
+        input_size = await file_size(input_path)
+        if not input_size:
+            raise RuntimeError("Input download failed / empty file")
+
+        logger.info(f"[JOB {job_id}] input size={input_size}")
+        input_src = str(input_path)
+
+    media = await probe_media(input_src)
+    check_spans(spans, media)
+    logger.info(f"[JOB {job_id}] input duration={media['duration']:.2f}s audio={media['has_audio']}")
+
+    # a span listed twice in Order: is cut once and referenced twice in the concat list
+    unique_spans = list(dict.fromkeys(spans))
+    output_seconds = sum(e - s for s, e in unique_spans)
+    encoded = dict.fromkeys(unique_spans, 0.0)
+    last_report = 0.0
+
+    async def report_progress():
+        nonlocal last_report
+        now = asyncio.get_running_loop().time()
+        if now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            await update_job(job_id, {"progress": min(99, int(100 * sum(encoded.values()) / output_seconds))})
+
+    def span_progress(span: tuple):
+        async def on_progress(encoded_seconds: float):
+            encoded[span] = encoded_seconds
+            await report_progress()
+        return on_progress
+
+    # keyframe-aligned cuts into the same container can skip decode/encode entirely;
+    # copy_span maps each requested span to the exact keyframe-started span that gets cut
+    copy_span = None
+    if out_fmt == input_ext:
+        snapped = snap_to_keyframes(unique_spans, await keyframe_times(input_src, unique_spans))
+        if snapped:
+            copy_span = dict(zip(unique_spans, snapped))
+    stream_copy = copy_span is not None
+
+    async def write_output(cmd: list, on_progress=None):
+        if out_fmt in PIPE_OUTPUT_FORMATS:
+            # upload while muxing; no local output file to write and read back
+            cmd = cmd + ["-f", out_fmt, "-movflags", "+frag_keyframe+empty_moov", "pipe:1"]
+            size = await encode_to_s3(cmd, SPACES_BUCKET, output_key, on_progress)
+            logger.info(f"[JOB {job_id}] streamed output size={size} to {output_key}")
+            return
+        await run_tool(cmd + [str(output_path)], on_progress)
+
+        output_size = await file_size(output_path)
+        if not output_size:
+            raise RuntimeError("Output not created / empty")
+
+        logger.info(f"[JOB {job_id}] output size={output_size}")
+
+        # upload output
+        logger.info(f"[JOB {job_id}] upload output_key={output_key}")
+        await asyncio.to_thread(s3.upload_file, str(output_path), SPACES_BUCKET, output_key, Config=TRANSFER_CFG)
+
+    if len(spans) == 1:
+        # one cut: straight from input to output, no parts or concat pass
+        span = spans[0]
+        logger.info(f"[JOB {job_id}] single segment {'copy' if stream_copy else 'encode ' + ' '.join(video_args)}")
+        async with FFMPEG_SEM:
+            if stream_copy:
+                await write_output(cut_cmd(input_src, copy_span[span], None))
+            else:
+                await write_output(cut_cmd(input_src, span, video_args), span_progress(span))
+        return
+
+    if stream_copy:
+        logger.info(f"[JOB {job_id}] stream copy {len(unique_spans)} segment(s)")
+        part_for = {span: OUTPUT_DIR / f"{job_id}_part{i}.{input_ext}" for i, span in enumerate(unique_spans)}
+        temp_paths += part_for.values()
+        await asyncio.gather(*[copy_segment(input_src, copy_span[span], part) for span, part in part_for.items()])
+    else:
+        # independent spans encode in parallel, each holding its own FFMPEG_SEM slot
+        logger.info(f"[JOB {job_id}] encode {len(unique_spans)} segment(s) {' '.join(video_args)}")
+        part_for = {span: OUTPUT_DIR / f"{job_id}_part{i}.ts" for i, span in enumerate(unique_spans)}
+        temp_paths += part_for.values()
+        was_encoded = await asyncio.gather(*[
+            render_segment(input_src, span, video_args, part, segment_cache_key(video_id, span, video_args), span_progress(span))
+            for span, part in part_for.items()
+        ])
+
+    concat_list = OUTPUT_DIR / f"{job_id}_concat.txt"
+    temp_paths.append(concat_list)
+    await write_concat_list([part_for[span] for span in spans], concat_list)
+    await write_output(["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(concat_list), *OUTPUT_STREAM_MAP, "-c", "copy"])
+
+    if not stream_copy:
+        # fill the segment cache after the output is delivered, off the job's latency path;
+        # the store task owns (and removes) the part files from here on
+        fresh = [(part, segment_cache_key(video_id, span, video_args))
+                 for (span, part), fresh_part in zip(part_for.items(), was_encoded) if fresh_part]
+        if fresh:
+            for part, _ in fresh:
+                temp_paths.remove(part)
+            task = asyncio.create_task(store_segments(fresh))
+            segment_store_tasks.add(task)
+            task.add_done_callback(segment_store_tasks.discard)
+
 async def process_job(job_id: str):
     logger.info(f"[JOB {job_id}] start")
 
-    input_path = None
-    output_path = None
+    temp_paths = []
 
     try:
         job = await db.jobs.find_one({"job_id": job_id}, {"_id": 0})
@@ -827,7 +1457,7 @@ async def process_job(job_id: str):
             logger.error(f"[JOB {job_id}] not found")
             return
 
-        await db.jobs.update_one({"job_id": job_id}, {"$set": {"status": "processing"}})
+        await update_job(job_id, {"status": "processing"})
         logger.info(f"[JOB {job_id}] status=processing")
 
         video = await db.videos.find_one({"video_id": job["video_id"]}, {"_id": 0})
@@ -841,7 +1471,8 @@ async def process_job(job_id: str):
         segments = parsed.get("segments") or []
         order = parsed.get("order") or [s.get("index") for s in segments]
         out_fmt = (parsed.get("output_format") or "mp4").lower()
-        crf = quality_to_crf(parsed.get("quality"))
+        quality = parsed.get("quality")
+        video_args = video_encode_args(quality_to_crf(quality), quality_to_preset(quality))
 
         if not segments:
             raise RuntimeError("No segments found in prompt. Use: Keep: 00:00-00:10")
@@ -857,117 +1488,60 @@ async def process_job(job_id: str):
         if not ordered:
             raise RuntimeError("Segment order invalid / no segments matched")
 
-        # local file paths
-        input_ext = (video.get("extension") or "mp4").lower()
-        input_path = UPLOAD_DIR / f"{job_id}_input.{input_ext}"
-        output_path = OUTPUT_DIR / f"{job_id}_output.{out_fmt}"
-        output_key = f"outputs/{job['user_id']}/{job_id}.{out_fmt}"
-
-        logger.info(f"[JOB {job_id}] download to {input_path}")
-
-        # ensure the object is readable (Spaces consistency / race)
-        await head_with_retry(SPACES_BUCKET, input_key)
-
-        # download from Spaces
-        s3.download_file(SPACES_BUCKET, input_key, str(input_path))
-        if not input_path.exists() or input_path.stat().st_size == 0:
-            raise RuntimeError("Input download failed / empty file")
-
-        logger.info(f"[JOB {job_id}] input size={input_path.stat().st_size}")
-
-        # Build filter_complex:
-        # [0:v]trim=start=..:end=..,setpts=PTS-STARTPTS[v0];
-        # [0:a]atrim=start=..:end=..,asetpts=PTS-STARTPTS[a0];
-        # ... concat=n=N:v=1:a=1[outv][outa]
-        filter_parts = []
-        concat_inputs = []
-        for i, seg in enumerate(ordered):
+        spans = []
+        for seg in ordered:
             s = ts_to_seconds(seg["start"])
             e = ts_to_seconds(seg["end"])
             if e <= s:
                 raise RuntimeError(f"Invalid segment: {seg['start']}-{seg['end']}")
+            spans.append((s, e))
 
-            filter_parts.append(f"[0:v]trim=start={s}:end={e},setpts=PTS-STARTPTS[v{i}]")
-            filter_parts.append(f"[0:a]atrim=start={s}:end={e},asetpts=PTS-STARTPTS[a{i}]")
-            concat_inputs.append(f"[v{i}][a{i}]")
-
-        filter_complex = ";".join(filter_parts) + ";" + "".join(concat_inputs) + f"concat=n={len(ordered)}:v=1:a=1[outv][outa]"
-        logger.info(f"[JOB {job_id}] filter_complex={filter_complex}")
-
-        # ffmpeg command (re-encode for accurate cuts)
-        cmd = [
-            "ffmpeg", "-y",
-            "-i", str(input_path),
-            "-filter_complex", filter_complex,
-            "-map", "[outv]",
-            "-map", "[outa]",
-            "-c:v", "libx264",
-            "-preset", "medium",
-            "-crf", str(crf),
-            "-c:a", "aac",
-            "-b:a", "128k",
-            str(output_path)
-        ]
-
-        logger.info(f"[JOB {job_id}] run ffmpeg: {' '.join(cmd)}")
-
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        _, stderr = await proc.communicate()
-
-        if proc.returncode != 0:
-            err = stderr.decode(errors="ignore")
-            raise RuntimeError(f"ffmpeg failed: {err[:2000]}")
-
-        if not output_path.exists() or output_path.stat().st_size == 0:
-            raise RuntimeError("Output not created / empty")
-
-        logger.info(f"[JOB {job_id}] output size={output_path.stat().st_size}")
+        input_ext = (video.get("extension") or "mp4").lower()
+        output_key = f"outputs/{job['user_id']}/{job_id}.{out_fmt}"
 
-        # upload output
-        logger.info(f"[JOB {job_id}] upload output_key={output_key}")
-        s3.upload_file(str(output_path), SPACES_BUCKET, output_key)
+        # the same cut of the same video is rendered once; reruns are a server-side copy
+        cache_key = output_cache_key(job["video_id"], spans, out_fmt, video_args)
+        if await copy_object_if_exists(cache_key, output_key):
+            logger.info(f"[JOB {job_id}] output cache hit {cache_key}")
+        else:
+            await render_output(job_id, job["video_id"], input_key, input_ext, spans, out_fmt, video_args, output_key, temp_paths)
+            try:
+                await copy_object_if_exists(output_key, cache_key)
+            except Exception as e:
+                logger.warning(f"[JOB {job_id}] output cache store failed: {e}")
 
         # verify output exists
-        s3.head_object(Bucket=SPACES_BUCKET, Key=output_key)
+        await asyncio.to_thread(s3.head_object, Bucket=SPACES_BUCKET, Key=output_key)
         logger.info(f"[JOB {job_id}] output verified")
 
-        await db.jobs.update_one(
-            {"job_id": job_id},
-            {"$set": {
+        now = datetime.now(timezone.utc)
+        today = now.strftime("%Y-%m-%d")
+        # job status and the daily counter are independent writes; overlap them
+        await asyncio.gather(
+            update_job(job_id, {
                 "status": "done",
+                "progress": 100,
                 "output_key": output_key,
-                "output_expires_at": (datetime.now(timezone.utc) + timedelta(days=OUTPUT_EXPIRY_DAYS)).isoformat(),
-                "completed_at": datetime.now(timezone.utc).isoformat()
-            }}
+                "output_expires_at": (now + timedelta(days=OUTPUT_EXPIRY_DAYS)).isoformat(),
+                "completed_at": now.isoformat()
+            }),
+            db.metrics.update_one({"date": today}, {"$inc": {"videos_processed": 1}}, upsert=True),
         )
 
-        # metrics
-        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        await db.metrics.update_one({"date": today}, {"$inc": {"videos_processed": 1}}, upsert=True)
-
         logger.info(f"[JOB {job_id}] done")
 
     except Exception as e:
         logger.exception(f"[JOB {job_id}] failed: {e}")
-        await db.jobs.update_one(
-            {"job_id": job_id},
-            {"$set": {
-                "status": "failed",
-                "error_message": str(e),
-                "completed_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
+        await update_job(job_id, {
+            "status": "failed",
+            "error_message": str(e),
+            "completed_at": datetime.now(timezone.utc).isoformat()
+        })
     finally:
         # cleanup local files
         try:
-            if input_path and input_path.exists():
-                input_path.unlink()
-            if output_path and output_path.exists():
-                output_path.unlink()
+            for path in temp_paths:
+                path.unlink(missing_ok=True)
         except Exception as ce:
             logger.warning(f"[JOB {job_id}] cleanup error: {ce}")
 
@@ -983,20 +1557,15 @@ async def create_job(input: JobCreateInput, background_tasks: BackgroundTasks, u
     if video.get("payment_required") and not video.get("payment_completed"):
         raise HTTPException(status_code=402, detail="Payment required")
     
-    # Check active subscription
-    subscription = await db.subscriptions.find_one(
-        {"user_id": user["user_id"], "status": "active"},
-        {"_id": 0}
-    )
-    
     if len(input.prompt_text) > 1000:
         raise HTTPException(status_code=400, detail="Prompt exceeds 1000 characters")
     
     # Parse prompt
     parsed = parse_prompt(input.prompt_text)
     
-    job_id = f"job_{uuid.uuid4().hex[:12]}"
+    job_id = new_job_id()
     job = {
+        "_id": job_id,
         "job_id": job_id,
         "user_id": user["user_id"],
         "video_id": input.video_id,
@@ -1017,26 +1586,32 @@ async def create_job(input: JobCreateInput, background_tasks: BackgroundTasks, u
     
     return {"job_id": job_id, "status": "queued"}
 
+# List view only needs status/summary fields, not parsed_prompt or storage keys
+JOB_LIST_PROJECTION = {
+    "_id": 0, "job_id": 1, "video_id": 1, "prompt_text": 1, "status": 1,
+    "error_message": 1, "created_at": 1, "completed_at": 1, "output_expires_at": 1,
+}
+
 @api_router.get("/jobs")
 async def list_jobs(user: dict = Depends(get_current_user)):
     """List user's recent jobs"""
     jobs = await db.jobs.find(
         {"user_id": user["user_id"]},
-        {"_id": 0}
+        JOB_LIST_PROJECTION
     ).sort("created_at", -1).limit(20).to_list(20)
     return jobs
 
 @api_router.get("/jobs/{job_id}")
 async def get_job(job_id: str, user: dict = Depends(get_current_user)):
     """Get job details"""
-    job = await db.jobs.find_one({"job_id": job_id, "user_id": user["user_id"]}, {"_id": 0})
+    job = await find_user_job(job_id, user["user_id"])
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     return job
 
 @api_router.get("/jobs/{job_id}/download")
 async def get_download_url(job_id: str, user: dict = Depends(get_current_user)):
-    job = await db.jobs.find_one({"job_id": job_id, "user_id": user["user_id"]}, {"_id": 0})
+    job = await find_user_job(job_id, user["user_id"])
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
@@ -1045,12 +1620,13 @@ async def get_download_url(job_id: str, user: dict = Depends(get_current_user)):
 
     # Ensure object exists in Spaces (prevents broken links)
     try:
-        s3.head_object(Bucket=SPACES_BUCKET, Key=job["output_key"])
+        await asyncio.to_thread(s3.head_object, Bucket=SPACES_BUCKET, Key=job["output_key"])
     except Exception:
         raise HTTPException(status_code=404, detail="Output file not found. Job may have failed to upload output.")
 
     # Presigned GET URL (valid for 30 mins)
-    url = s3.generate_presigned_url(
+    url = await asyncio.to_thread(
+        s3.generate_presigned_url,
         ClientMethod="get_object",
         Params={"Bucket": SPACES_BUCKET, "Key": job["output_key"]},
         ExpiresIn=60 * 60 * 24 * 7
@@ -1060,56 +1636,152 @@ async def get_download_url(job_id: str, user: dict = Depends(get_current_user)):
 
 # ============== METRICS ENDPOINTS ==============
 
-@api_router.get("/metrics/summary", response_model=MetricsSummary)
+METRICS_CACHE_KEY = "metrics:summary"
+METRICS_CACHE_TTL = 30  # seconds; the summary tolerates a little staleness
+
+@api_router.get("/metrics/summary")
 async def get_metrics_summary():
-    """Get metrics summary"""
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    
-    # Get all metrics
-    all_metrics = await db.metrics.find({}, {"_id": 0}).to_list(1000)
+    """Get metrics summary: lifetime_/today_ visitors and videos_processed counts"""
+    cached = await cache_get(METRICS_CACHE_KEY)
+    if cached:
+        return cached
     
-    lifetime_visitors = sum(m.get("visitors", 0) for m in all_metrics)
-    lifetime_videos = sum(m.get("videos_processed", 0) for m in all_metrics)
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     
-    today_metric = next((m for m in all_metrics if m.get("date") == today), {})
+    # Lifetime totals and today's row in one aggregation round-trip
+    agg = await db.metrics.aggregate([
+        {"$facet": {
+            "lifetime": [
+                {"$group": {"_id": None, "visitors": {"$sum": "$visitors"}, "videos_processed": {"$sum": "$videos_processed"}}}
+            ],
+            "today": [
+                {"$match": {"date": today}},
+                {"$project": {"_id": 0, "visitors": 1, "videos_processed": 1}}
+            ],
+        }}
+    ]).to_list(1)
+    totals = agg[0]["lifetime"][0] if agg and agg[0]["lifetime"] else {}
+    today_metric = agg[0]["today"][0] if agg and agg[0]["today"] else {}
     
-    return MetricsSummary(
-        lifetime_visitors=lifetime_visitors or 1234,  # Default demo values
-        lifetime_videos_processed=lifetime_videos or 567,
-        today_visitors=today_metric.get("visitors", 42),
-        today_videos_processed=today_metric.get("videos_processed", 12)
-    )
+    summary = {
+        "lifetime_visitors": totals.get("visitors", 0) or 1234,  # Default demo values
+        "lifetime_videos_processed": totals.get("videos_processed", 0) or 567,
+        "today_visitors": today_metric.get("visitors", 42),
+        "today_videos_processed": today_metric.get("videos_processed", 12)
+    }
+    await cache_set(METRICS_CACHE_KEY, summary, METRICS_CACHE_TTL)
+    return summary
 
 # ============== VISITOR TRACKING MIDDLEWARE ==============
 
+VISITOR_FLUSH_INTERVAL = 60  # seconds between Redis -> Mongo counter flushes
+
+SEEN_VISITORS_MAX = 10_000
+# visitor/day pairs this process already counted; repeat page loads skip Redis entirely
+seen_visitors = OrderedDict()
+
+def seen_today(visitor_key: str) -> bool:
+    if visitor_key in seen_visitors:
+        seen_visitors.move_to_end(visitor_key)
+        return True
+    seen_visitors[visitor_key] = None
+    if len(seen_visitors) > SEEN_VISITORS_MAX:
+        seen_visitors.popitem(last=False)
+    return False
+
+async def record_visitor_in_mongo(visitor_id: str, today: str):
+    visitor_key = f"{visitor_id}_{today}"
+    # _id is the visitor/day key, so the upsert is idempotent; only a fresh insert counts
+    try:
+        result = await db.visitor_tracking.update_one(
+            {"_id": visitor_key},
+            {"$setOnInsert": {"key": visitor_key, "date": today}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return  # a concurrent upsert for the same visitor won
+    if result.upserted_id is None:
+        return
+    await db.metrics.update_one(
+        {"date": today},
+        {"$inc": {"visitors": 1}},
+        upsert=True
+    )
+
+async def record_visitor(visitor_id: str, today: str):
+    """Count a visitor once per day; Redis counters are flushed to Mongo periodically"""
+    if seen_today(f"{visitor_id}_{today}"):
+        return
+    try:
+        first_visit = await redis.set(f"vt:{visitor_id}:{today}", b"1", nx=True, ex=25 * 60 * 60)
+        if first_visit:
+            await redis.incr(f"visitors:{today}")
+    except Exception as e:
+        logger.warning(f"Redis visitor tracking failed, using Mongo: {e}")
+        await record_visitor_in_mongo(visitor_id, today)
+
+async def flush_visitor_counts():
+    """Move per-day visitor counters from Redis into db.metrics"""
+    async for key in redis.scan_iter(match="visitors:*"):
+        count = await redis.getdel(key)
+        if not count:
+            continue
+        date = key.decode().split(":", 1)[1]
+        try:
+            await db.metrics.update_one({"date": date}, {"$inc": {"visitors": int(count)}}, upsert=True)
+        except Exception:
+            # put the count back so the next flush retries it
+            await redis.incrby(key, int(count))
+            raise
+
+async def visitor_flush_loop():
+    while True:
+        await asyncio.sleep(VISITOR_FLUSH_INTERVAL)
+        try:
+            await flush_visitor_counts()
+        except Exception as e:
+            logger.warning(f"Visitor count flush failed: {e}")
+
+STATIC_SUFFIXES = (".js", ".css", ".map", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".ico", ".webp", ".woff", ".woff2", ".json", ".txt")
+
+VISITOR_QUEUE_MAX = 10_000
+# page loads enqueue (visitor_id, date); one consumer records them off the request path
+visitor_queue = asyncio.Queue(maxsize=VISITOR_QUEUE_MAX)
+
+async def track_visit(visitor_id: str, today: str):
+    try:
+        await record_visitor(visitor_id, today)
+    except Exception as e:
+        logger.warning(f"Visitor tracking skipped: {e}")
+
+async def visitor_consumer():
+    while True:
+        visitor_id, today = await visitor_queue.get()
+        await track_visit(visitor_id, today)
+        visitor_queue.task_done()
+
 @app.middleware("http")
 async def track_visitors(request: Request, call_next):
     """Track unique visitors per day"""
+    # Only track page requests, not API calls or static assets
+    path = request.url.path
+    if path.startswith("/api") or path.endswith(STATIC_SUFFIXES):
+        return await call_next(request)
+    
     response = await call_next(request)
     
-    # Only track page requests, not API calls
-    if not request.url.path.startswith("/api"):
-        visitor_id = request.cookies.get("visitor_id")
-        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        
-        if not visitor_id:
-            visitor_id = f"v_{uuid.uuid4().hex[:12]}"
-            response.set_cookie("visitor_id", visitor_id, max_age=24*60*60)
-        
-        # Check if already counted today
-        visitor_key = f"{visitor_id}_{today}"
-        try:
-            existing = await db.visitor_tracking.find_one({"key": visitor_key})
-            if not existing:
-                await db.visitor_tracking.insert_one({"key": visitor_key, "date": today})
-                await db.metrics.update_one(
-                    {"date": today},
-                    {"$inc": {"visitors": 1}},
-                    upsert=True
-                )
-        except Exception as e:
-            logger.warning(f"Visitor tracking skipped: {e}")
-
+    visitor_id = request.cookies.get("visitor_id")
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    
+    if not visitor_id:
+        visitor_id = f"v_{uuid.uuid4().hex[:12]}"
+        response.set_cookie("visitor_id", visitor_id, max_age=24*60*60)
+    
+    # Count once per visitor per day, without holding up the response
+    try:
+        visitor_queue.put_nowait((visitor_id, today))
+    except asyncio.QueueFull:
+        pass  # shed tracking, not page loads, during a spike
     
     return response
 
@@ -1135,6 +1807,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON responses larger than 1KB (job lists, metrics, user docs)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Sample any request with ?profile=1 (only when ENABLE_PROFILING=1)
+if os.environ.get("ENABLE_PROFILING") == "1":
+    from pyinstrument import Profiler
+
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        if not request.query_params.get("profile"):
+            return await call_next(request)
+        profiler = Profiler(async_mode="enabled")
+        profiler.start()
+        await call_next(request)
+        profiler.stop()
+        return HTMLResponse(profiler.output_html())
+
+@app.on_event("startup")
+async def warm_mongo():
+    """Open the pool at boot so the first request doesn't pay the handshake"""
+    try:
+        await client.admin.command("ping")
+    except Exception as e:
+        logger.warning(f"MongoDB warm-up ping failed: {e}")
+
+# (collection, keys, options) for the hot lookups; TTL indexes let Mongo purge expired rows
+MONGO_INDEXES = [
+    ("users", "user_id", {"unique": True}),
+    ("users", "email", {"unique": True}),
+    ("user_sessions", "session_token", {"unique": True}),
+    ("user_sessions", "expires_at", {"expireAfterSeconds": 0}),
+    ("jobs", "job_id", {"unique": True}),
+    ("jobs", [("user_id", 1), ("created_at", -1)], {}),
+    ("videos", [("video_id", 1), ("user_id", 1)], {}),
+    ("payments", "razorpay_order_id", {"unique": True}),
+    ("visitor_tracking", "key", {"unique": True}),
+    ("metrics", "date", {"unique": True}),
+]
+
+@app.on_event("startup")
+async def create_indexes():
+    for collection, keys, options in MONGO_INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except Exception as e:
+            # Don't block startup on a bad index (e.g. existing duplicates)
+            logger.warning(f"Index creation failed for {collection} {keys}: {e}")
+
+@app.on_event("startup")
+async def probe_ffmpeg_encoder():
+    global nvenc_available
+    if FFMPEG_HWACCEL == "nvenc":
+        nvenc_available = await detect_nvenc()
+        if not nvenc_available:
+            logger.warning("FFMPEG_HWACCEL=nvenc but h264_nvenc is unusable; falling back to libx264")
+
+@app.on_event("startup")
+async def apply_render_cache_lifecycle():
+    try:
+        await asyncio.to_thread(ensure_render_cache_lifecycle)
+    except Exception as e:
+        # the cache still works; it just won't expire until the rule is added by hand
+        logger.warning(f"Could not set lifecycle rule for {RENDER_CACHE_PREFIX}: {e}")
+
+@app.on_event("startup")
+async def start_visitor_flush():
+    app.state.visitor_consumer_task = asyncio.create_task(visitor_consumer())
+    app.state.visitor_flush_task = asyncio.create_task(visitor_flush_loop())
+
+@app.on_event("shutdown")
+async def stop_visitor_flush():
+    app.state.visitor_consumer_task.cancel()
+    app.state.visitor_flush_task.cancel()
+    # record whatever is still queued, then push the counters to Mongo
+    while not visitor_queue.empty():
+        await track_visit(*visitor_queue.get_nowait())
+    try:
+        await flush_visitor_counts()
+    except Exception as e:
+        logger.warning(f"Final visitor count flush failed: {e}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+    await redis.aclose()
+    await http_client.aclose()
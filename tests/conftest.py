@@ -0,0 +1,8 @@
+import os
+import sys
+from pathlib import Path
+
+# server.py lives in backend/ and reads these at import time; tests never call the services
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+for key in ("MONGO_URL", "DB_NAME", "RAZORPAY_KEY_ID", "RAZORPAY_KEY_SECRET", "RAZORPAY_WEBHOOK_SECRET"):
+    os.environ.setdefault(key, "mongodb://localhost:27017" if key == "MONGO_URL" else "test")
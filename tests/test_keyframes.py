@@ -0,0 +1,22 @@
+from server import snap_to_keyframes
+
+
+def test_start_just_before_keyframe_snaps_forward():
+    # -ss 1.97 would seek back to the keyframe at 0.0 and copy the whole first GOP
+    assert snap_to_keyframes([(1.97, 5.0)], [0.0, 2.0, 4.0]) == [(2.0, 5.0)]
+
+
+def test_start_just_after_keyframe_snaps_back():
+    assert snap_to_keyframes([(2.03, 5.0)], [0.0, 2.0, 4.0]) == [(2.0, 5.0)]
+
+
+def test_exact_keyframe_starts_are_kept():
+    assert snap_to_keyframes([(0.0, 1.5), (4.0, 6.0)], [0.0, 2.0, 4.0]) == [(0.0, 1.5), (4.0, 6.0)]
+
+
+def test_any_unaligned_start_disables_copy():
+    assert snap_to_keyframes([(0.0, 1.0), (3.0, 5.0)], [0.0, 2.0, 4.0]) is None
+
+
+def test_no_keyframes():
+    assert snap_to_keyframes([(0.0, 1.0)], []) is None
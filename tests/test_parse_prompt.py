@@ -0,0 +1,64 @@
+from server import parse_prompt
+
+
+def test_full_prompt():
+    result = parse_prompt("Keep: 00:00-00:12, 00:25-00:40. Order: 2,1. Output: MP4. Quality: High.")
+    assert result["segments"] == [
+        {"index": 1, "start": "00:00", "end": "00:12"},
+        {"index": 2, "start": "00:25", "end": "00:40"},
+    ]
+    assert result["order"] == [2, 1]
+    assert result["output_format"] == "mp4"
+    assert result["quality"] == "high"
+
+
+def test_defaults_without_order():
+    result = parse_prompt("Keep: 00:00-00:05, 00:10-00:15")
+    assert result["order"] == [1, 2]
+    assert result["output_format"] == "mp4"
+    assert result["quality"] == "medium"
+
+
+def test_explicit_order_is_honoured():
+    assert parse_prompt("Keep: 0-5, 10-15, 20-25. Order: 3,1")["order"] == [3, 1]
+
+
+def test_bad_order_falls_back_to_default():
+    assert parse_prompt("Keep: 0-5, 10-15. Order: 2, two")["order"] == [1, 2]
+
+
+def test_malformed_ranges_are_skipped_but_keep_their_position():
+    # Order: refers to positions in the list, so index 2 must not shift down to fill the gap
+    result = parse_prompt("Keep: 0-5, garbage, 10-15, 1-2-3")
+    assert result["segments"] == [
+        {"index": 1, "start": "0", "end": "5"},
+        {"index": 3, "start": "10", "end": "15"},
+    ]
+    assert result["order"] == [1, 3]
+
+
+def test_fractional_timestamps_survive_sentence_split():
+    result = parse_prompt("Keep: 00:01.5-00:03.25, 00:10-00:12.5. Order: 2,1. Quality: low.")
+    assert result["segments"] == [
+        {"index": 1, "start": "00:01.5", "end": "00:03.25"},
+        {"index": 2, "start": "00:10", "end": "00:12.5"},
+    ]
+    assert result["order"] == [2, 1]
+    assert result["quality"] == "low"
+
+
+def test_keys_are_case_and_space_insensitive():
+    result = parse_prompt("KEEP : 0-5. order:1. OUTPUT : MOV. quality : HIGH")
+    assert result["segments"] == [{"index": 1, "start": "0", "end": "5"}]
+    assert result["order"] == [1]
+    assert result["output_format"] == "mov"
+    assert result["quality"] == "high"
+
+
+def test_no_directives():
+    assert parse_prompt("just make it shorter") == {
+        "segments": [],
+        "order": [],
+        "output_format": "mp4",
+        "quality": "medium",
+    }